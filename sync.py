@@ -10,73 +10,375 @@ Usage:
 
 """
 
+import hashlib
 import logging
+import mmap
 import os
-from shutil import copy2, rmtree
+import sqlite3
+import stat
+import tempfile
+import threading
+from shutil import copyfile
 from argparse import ArgumentParser
-from time import sleep
-from hashlib import sha256
-from typing import Final, List
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from logging.handlers import MemoryHandler
+from time import monotonic, sleep
+from typing import Callable, Dict, Final, Iterator, List, Optional, Set, Tuple
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
 
 DEFAULT_INTERVAL: Final[int] = 15
 DEFAULT_LOG_PATH: Final[str] = 'output.log'
-
-
-def view_message(msg: str, log_level: str = 'debug') -> None:
+# Copies get the exact modification time of their source, so any larger difference is a change.
+# NTFS and SMB keep 100 ns, the window absorbs that truncation
+DEFAULT_MODIFY_WINDOW_NS: Final[int] = 1_000
+DEFAULT_CACHE_PATH: Final[str] = os.path.join('~', '.dir-sync', 'cache.db')
+SMALL_FILE_SIZE: Final[int] = 64 << 10
+MMAP_THRESHOLD: Final[int] = 256 << 10
+CHUNK_SIZE: Final[int] = 1 << 20
+# Files handled at once. Hashing releases the GIL and copying blocks on I/O, so this may
+# exceed the core count, but unbounded concurrency degrades network and FUSE filesystems
+DEFAULT_PARALLELISM: Final[int] = 16
+# Only OpenSSL's SHA-256 uses the SHA-NI / ARMv8 crypto extensions when the CPU provides them,
+# Python falls back to its much slower builtin implementation when built without OpenSSL
+OPENSSL_SHA256: Final[bool] = hashlib.sha256.__name__ == 'openssl_sha256'
+# Hash constructors by name, BLAKE3 and XXH3 are only available when their packages are installed
+HASH_ALGORITHMS: Final[Dict[str, Callable]] = {'sha256': hashlib.sha256}
+if blake3 is not None:
+    HASH_ALGORITHMS['blake3'] = blake3.blake3
+if xxhash is not None:
+    HASH_ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+# SHA-256 stays available for setups that require a FIPS approved hash
+DEFAULT_ALGORITHM: Final[str] = 'blake3' if blake3 is not None else 'sha256'
+# Number of log records buffered before they are written to the log file
+LOG_BUFFER_CAPACITY: Final[int] = 1000
+# In watch mode the whole source is still rescanned after this many idle intervals
+FULL_SWEEP_INTERVALS: Final[int] = 20
+# Events arriving within this many milliseconds of each other are handled by a single pass
+WATCH_DEBOUNCE_MS: Final[int] = 100
+
+
+def view_message(msg: str, *args: object, log_level: str = 'debug') -> None:
     """
     Prints message to standard output and to the log
     Args:
-        msg (str): Message to display.
-        log_level (str): Type of log level ('debug' or 'error'). Default value is 'debug'
+        msg (str): Message to display, a %-style format string when args are given.
+        args (object): Arguments merged into the message, formatted lazily by the logger.
+        log_level (str): Type of log level ('debug', 'warning' or 'error'). Default value is 'debug'
     Returns:
         Nothing
     """
     if log_level == 'error':
-        logging.error(msg)
+        logging.error(msg, *args)
+    elif log_level == 'warning':
+        logging.warning(msg, *args)
     else:
-        logging.debug(msg)
-    print(msg)
+        logging.debug(msg, *args)
+    print(msg % args if args else msg)
+
+
+class ChecksumCache:
+    """
+    Persistent cache of file checksums, keyed by the path, size and modification time of a file.
+    Each hash algorithm has a table of its own. Writes are batched in a transaction until
+    commit() is called.
+    The cache may be shared between threads, files are hashed outside of its lock.
+    Files not looked up between two calls to prune() are dropped from it.
+    """
+
+    def __init__(self, cache_path: str, algorithm: str = DEFAULT_ALGORITHM) -> None:
+        """
+        Args:
+            cache_path (str): The path to the SQLite database, created if missing.
+            algorithm (str): The name of the hash algorithm, a key of HASH_ALGORITHMS.
+        """
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.algorithm = algorithm
+        # Algorithm names are fixed identifiers, safe to use as part of the table name
+        self.table = f'{algorithm}_hashes'
+        self.lock = threading.Lock()
+        # Paths looked up or stored since the last prune
+        self.seen: Set[str] = set()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute(f'CREATE TABLE IF NOT EXISTS {self.table}('
+                                'path TEXT PRIMARY KEY, size INT, mtime_ns INT, digest BLOB)')
+
+    def get_checksum(self, file: str, file_stat: Optional[os.stat_result] = None,
+                     mapped: bool = False) -> bytes:
+        """
+        Return the cached checksum of a file, hashing it only if it changed since it was cached.
+
+        Args:
+            file (str): The path to the file to get the checksum of.
+            file_stat (os.stat_result): Already known stat of the file, saves a stat call.
+            mapped (bool): Memory map the file if it is large, see get_checksum().
+
+        Returns:
+            bytes: The digest of the file.
+        """
+        if file_stat is None:
+            file_stat = os.stat(file)
+        path = os.path.abspath(file)
+        with self.lock:
+            self.seen.add(path)
+            row = self.connection.execute(
+                f'SELECT size, mtime_ns, digest FROM {self.table} WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[:2] == (file_stat.st_size, file_stat.st_mtime_ns):
+            return row[2]
+        digest = get_checksum(file, self.algorithm, mapped)
+        self.set_checksum(file, file_stat, digest)
+        return digest
+
+    def set_checksum(self, file: str, file_stat: os.stat_result, digest: bytes) -> None:
+        """
+        Store an already known checksum of a file.
+
+        Args:
+            file (str): The path to the file the checksum belongs to.
+            file_stat (os.stat_result): The stat of the file the checksum was calculated for.
+            digest (bytes): The digest of the file.
+
+        Returns:
+            Nothing
+        """
+        path = os.path.abspath(file)
+        with self.lock:
+            self.seen.add(path)
+            self.connection.execute(f'INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)',
+                                    (path, file_stat.st_size, file_stat.st_mtime_ns, digest))
+
+    def prune(self, directories: List[str]) -> None:
+        """
+        Drop the checksums of files inside the directories that were not looked up or stored
+        since the last prune, such as files that were deleted. Files outside the directories
+        are kept, as the cache may be shared with other synchronizations.
+
+        Args:
+            directories (List[str]): The paths to the directories that were fully synchronized.
+
+        Returns:
+            Nothing
+        """
+        prefixes = tuple(os.path.join(os.path.abspath(directory), '') for directory in directories)
+        with self.lock:
+            stale_paths = [(path,) for path, in self.connection.execute(f'SELECT path FROM {self.table}')
+                           if path.startswith(prefixes) and path not in self.seen]
+            self.connection.executemany(f'DELETE FROM {self.table} WHERE path = ?', stale_paths)
+            self.seen.clear()
+
+    def commit(self) -> None:
+        """
+        Write the checksums cached since the last commit to disk.
+        """
+        with self.lock:
+            self.connection.commit()
+
+    def close(self) -> None:
+        """
+        Commit pending checksums and close the database.
+        """
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def _walk(directory: str, rel_path: str = '') -> Iterator[Tuple[os.DirEntry, str]]:
+    """
+    Recursively yield the entries of a directory, parents before their contents.
+    Symbolic links to directories are not followed and unreadable directories are skipped.
+
+    Args:
+        directory (str): The path to the directory to walk.
+        rel_path (str): The path of the directory relative to the walk root, ending with a
+            separator unless empty.
+
+    Returns:
+        Iterator[Tuple[os.DirEntry, str]]: Entries paired with the relative path of their parent.
+    """
+    subdirs = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if entry.is_symlink():
+                        continue
+                    subdirs.append(entry)
+                yield entry, rel_path
+    except OSError:
+        return
+    for subdir in subdirs:
+        yield from _walk(subdir.path, f'{rel_path}{subdir.name}{os.sep}')
+
+
+def _list_names(directory: str) -> Set[str]:
+    """
+    Read the names of all entries in a directory with a single scan.
+
+    Args:
+        directory (str): The path to the directory to list.
 
+    Returns:
+        Set[str]: The names of the entries, empty if the directory cannot be read.
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries}
+    except OSError:
+        return set()
+
+
+def copy_file(src_file: str, dest_file: str, src_stat: os.stat_result) -> None:
+    """
+    Copy the contents, permissions and timestamps of a file.
+    The data is written to a temporary file next to the destination and then moved in place,
+    so readers never see a partially copied file.
+
+    Args:
+        src_file (str): The path to the file to copy.
+        dest_file (str): The path to the destination file, replaced if it exists.
+        src_stat (os.stat_result): The stat of the source file.
+
+    Returns:
+        Nothing
+    """
+    temp_fd, temp_file = tempfile.mkstemp(prefix='.', suffix='.tmp',
+                                          dir=os.path.dirname(dest_file))
+    os.close(temp_fd)
+    try:
+        # copyfile uses in-kernel copies (sendfile, copy_file_range) where available
+        copyfile(src_file, temp_file)
+        os.chmod(temp_file, stat.S_IMODE(src_stat.st_mode))
+        os.utime(temp_file, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        os.replace(temp_file, dest_file)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(temp_file)
+        raise
+
+
+def _sync_one(src_entry: os.DirEntry, dest_file: str, dest_exists: bool,
+              paranoid: bool = False, cache: Optional[ChecksumCache] = None,
+              algorithm: str = DEFAULT_ALGORITHM,
+              modify_window_ns: int = DEFAULT_MODIFY_WINDOW_NS) -> str:
+    """
+    Copy a single file to the destination if it is missing or outdated.
 
-def sync(source_dir: str, dest_dir: str) -> List[str]:
+    Args:
+        src_entry (os.DirEntry): The source file entry.
+        dest_file (str): The path to the destination file.
+        dest_exists (bool): Whether the destination file was present when its directory was listed.
+        paranoid (bool): Compare file contents by checksum instead of size and
+            modification time. Default value is False
+        cache (ChecksumCache): Cache of checksums used in paranoid mode.
+        algorithm (str): The hash algorithm used in paranoid mode without a cache.
+        modify_window_ns (int): The largest modification time difference, in nanoseconds,
+            treated as equal.
+
+    Returns:
+        str: The path to the destination file.
+    """
+    src_stat = src_entry.stat()
+    if not dest_exists:
+        view_message('%s created', dest_file)
+    elif is_updated(src_entry.path, dest_file, paranoid, src_stat, cache, algorithm,
+                    modify_window_ns):
+        view_message('%s updated', dest_file)
+    else:
+        return dest_file
+
+    copy_file(src_entry.path, dest_file, src_stat)
+    if paranoid and cache is not None:
+        # The copy has the size and modification time of the source, so it can be cached
+        # under the source checksum without reading it back
+        cache.set_checksum(dest_file, src_stat, cache.get_checksum(src_entry.path, src_stat))
+
+    return dest_file
+
+
+def sync(source_dir: str, dest_dir: str, paranoid: bool = False,
+         cache: Optional[ChecksumCache] = None,
+         algorithm: str = DEFAULT_ALGORITHM,
+         parallelism: int = DEFAULT_PARALLELISM,
+         modify_window_ns: int = DEFAULT_MODIFY_WINDOW_NS) -> List[str]:
     """
     Synchronize the files in a source directory with a destination directory.
 
     Args:
         source_dir (str): The path to the source directory.
         dest_dir (str): The path to the destination directory.
+        paranoid (bool): Compare file contents by checksum instead of size and
+            modification time. Default value is False
+        cache (ChecksumCache): Cache of checksums used in paranoid mode, pruned of files that
+            are gone and committed once per call.
+        algorithm (str): The hash algorithm used in paranoid mode without a cache.
+        parallelism (int): The most files synchronized at once, including the calling thread.
+            Default value is 16
+        modify_window_ns (int): The largest modification time difference, in nanoseconds,
+            treated as equal. Default value is 1 microsecond
 
     Returns:
         List[str]: A list of paths to the files that were synchronized.
     """
-    if not os.path.exists(dest_dir):
-        view_message(f'Destination created {dest_dir}')
+    # Names present in each destination directory, keyed by the relative directory path.
+    # Listing a directory once replaces an existence check for every file in it
+    dest_names: Dict[str, Set[str]] = {}
+    try:
         os.mkdir(dest_dir)
+        view_message('Destination created %s', dest_dir)
+        dest_names[''] = set()
+    except FileExistsError:
+        dest_names[''] = _list_names(dest_dir)
 
     synced_files = []
-    for root, _, files in os.walk(source_dir):
-        # Get the relative path of the current directory
-        rel_path = os.path.normpath(os.path.relpath(root, source_dir))
-        # Create the corresponding directory in the destination directory
-        dest_path = os.path.normpath(os.path.join(dest_dir, rel_path))
-
-        if not os.path.exists(dest_path):
-            view_message(f'Destination created {dest_path}')
-            os.mkdir(dest_path)
-        # Copy all the files in the current directory to the destination directory
-        for file in files:
-            src_file = os.path.join(root, file)
-            dest_file = os.path.join(dest_path, file)
-            if not os.path.exists(dest_file):
-                view_message(f'{dest_file} created')
-                copy2(src_file, dest_file)
-
-            if is_updated(src_file, dest_file):
-                view_message(f'{dest_file} updated')
-                copy2(src_file, dest_file)
-
-            synced_files.append(dest_file)
-
+    large_files = []
+    # Paths are built by concatenation, the walk already yields clean relative paths
+    dest_prefix = os.path.join(dest_dir, '')
+    sep = os.sep
+    # The pool size bounds the work in flight, files beyond it wait in the pool's queue
+    # without touching the filesystem. This thread syncs small files itself and counts against
+    # the parallelism, so the pool gets one worker less, none at all when syncing serially
+    workers = parallelism - 1
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        # Directories are created while walking so they exist before their files are copied
+        for entry, rel_path in _walk(source_dir):
+            dest_path = f'{dest_prefix}{rel_path}{entry.name}'
+            if entry.is_dir():
+                dir_path = f'{rel_path}{entry.name}{sep}'
+                try:
+                    os.mkdir(dest_path)
+                    view_message('Destination created %s', dest_path)
+                    dest_names[dir_path] = set()
+                except FileExistsError:
+                    dest_names[dir_path] = _list_names(dest_path)
+                continue
+            dest_exists = entry.name in dest_names[rel_path]
+            # Small files are synced right here, handing them to a worker costs more than the work
+            if not workers or entry.stat().st_size < SMALL_FILE_SIZE:
+                synced_files.append(_sync_one(entry, dest_path, dest_exists, paranoid,
+                                              cache, algorithm, modify_window_ns))
+            else:
+                large_files.append(executor.submit(_sync_one, entry, dest_path, dest_exists, paranoid,
+                                                   cache, algorithm, modify_window_ns))
+        synced_files.extend(future.result() for future in large_files)
+
+    if cache is not None:
+        if paranoid:
+            cache.prune([source_dir, dest_dir])
+        cache.commit()
     return synced_files
 
 
@@ -90,11 +392,7 @@ def read_dir(directory: str) -> List[str]:
     Returns:
         List[str]: A list of paths to the files in the directory.
     """
-    file_list = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            file_list.append(os.path.normpath(os.path.join(root, file)))
-    return file_list
+    return [entry.path for entry, _ in _walk(directory) if not entry.is_dir()]
 
 
 def remove_files(files: List[str]) -> None:
@@ -110,9 +408,9 @@ def remove_files(files: List[str]) -> None:
     for file in files:
         try:
             os.remove(file)
-            view_message(f'{file} removed')
+            view_message('%s removed', file)
         except OSError as error:
-            view_message(f'Error: {error.filename} - {error.strerror}',
+            view_message('Error: %s - %s', error.filename, error.strerror,
                          log_level='error')
 
 
@@ -126,44 +424,165 @@ def remove_empty_folders(root_dir: str) -> None:
     Returns:
         Nothing
     """
-    # Get list of directories sorted by the length of subdirectories skipping the root folder
-    listed_dirs = sorted(list(os.walk(root_dir))[1:],
-                         key=lambda x: x[0].split(os.path.sep),
-                         reverse=True)
-    unique_dirs = list(dict.fromkeys(
-        [os.path.normpath(listed_dir[0]) for listed_dir in listed_dirs]))
-    for unique_dir in unique_dirs:
-        if len(os.listdir(unique_dir)) == 0:
-            view_message(f'Empty directory "{unique_dir}" was removed')
-            rmtree(unique_dir)
-
-
-def get_checksum(file: str) -> int:
+    # Walking bottom-up visits children before their parents. The subdirectories listed
+    # for a directory may have just been removed, so rmdir, which refuses non-empty
+    # directories, decides whether it is empty
+    if os.rmdir in os.supports_dir_fd and hasattr(os, 'fwalk'):
+        # Remove children relative to the descriptor of their parent, which spares the
+        # kernel resolving their full path
+        for root, dirs, _, root_fd in os.fwalk(root_dir, topdown=False):
+            for name in dirs:
+                with suppress(OSError):
+                    os.rmdir(name, dir_fd=root_fd)
+                    view_message('Empty directory "%s" was removed', os.path.join(root, name))
+        return
+    for root, _, files in os.walk(root_dir, topdown=False):
+        if files or root == root_dir:
+            continue
+        with suppress(OSError):
+            os.rmdir(root)
+            view_message('Empty directory "%s" was removed', root)
+
+
+def get_checksum(file: str, algorithm: str = DEFAULT_ALGORITHM, mapped: bool = False) -> bytes:
     """
-    Calculate the SHA-256 checksum of a file.
+    Calculate the checksum of a file.
+    Small files are read in one go, large ones are hashed in chunks, so memory use does not
+    grow with the file size. Large mapped files are memory mapped and hashed without copying.
+    Mapping is only safe for files no other process truncates: touching a mapping past the end
+    of a file that shrank kills the process with SIGBUS, which Python cannot catch.
 
     Args:
         file (str): The path to the file to calculate the checksum of.
+        algorithm (str): The name of the hash algorithm, a key of HASH_ALGORITHMS.
+            Default value is BLAKE3 if installed, SHA-256 otherwise
+        mapped (bool): Memory map large files, for copies written by this tool only.
+            Default value is False
 
     Returns:
-        int: The SHA-256 checksum of the file as an integer.
+        bytes: The digest of the file.
     """
-    with open(file, 'rb') as file_data:
-        return int(sha256(file_data.read()).hexdigest(), 16)
-
-
-def is_updated(src_file: str, dest_file: str) -> bool:
+    hash_function = HASH_ALGORITHMS[algorithm]
+    with open(file, 'rb', buffering=0) as file_data:
+        # Setting up a mapping costs more than copying a small file
+        if os.fstat(file_data.fileno()).st_size <= MMAP_THRESHOLD:
+            return hash_function(file_data.read()).digest()
+        if not mapped:
+            # Reuse a single buffer rather than allocating a new bytes object per chunk
+            checksum = hash_function()
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            while size := file_data.readinto(buffer):
+                checksum.update(view[:size])
+            return checksum.digest()
+        if hasattr(hash_function, 'update_mmap'):
+            # BLAKE3 maps the file itself and hashes it on all cores
+            checksum = hash_function(max_threads=blake3.blake3.AUTO)
+            checksum.update_mmap(file)
+            return checksum.digest()
+        checksum = hash_function()
+        with mmap.mmap(file_data.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            if hasattr(mapping, 'madvise'):
+                mapping.madvise(mmap.MADV_SEQUENTIAL)
+                mapping.madvise(mmap.MADV_WILLNEED)
+            checksum.update(mapping)
+        return checksum.digest()
+
+def is_updated(src_file: str, dest_file: str, paranoid: bool = False,
+               src_stat: Optional[os.stat_result] = None,
+               cache: Optional[ChecksumCache] = None,
+               algorithm: str = DEFAULT_ALGORITHM,
+               modify_window_ns: int = DEFAULT_MODIFY_WINDOW_NS) -> bool:
     """
     Determine whether a source file is more recent than a destination file.
 
+    By default the files are compared by size and modification time only,
+    which avoids reading their contents. Modification times differing by no
+    more than the modify window count as equal, as destinations may store
+    them at a coarser resolution. In paranoid mode files of equal size are
+    compared by checksum instead.
+
     Args:
         src_file (str): The path to the source file to compare.
         dest_file (str): The path to the destination file to compare.
+        paranoid (bool): Compare checksums instead of file metadata. Default value is False
+        src_stat (os.stat_result): Already known stat of the source file, saves a stat call.
+        cache (ChecksumCache): Cache to look checksums up in during paranoid comparison.
+        algorithm (str): The hash algorithm used for paranoid comparison without a cache.
+        modify_window_ns (int): The largest modification time difference, in nanoseconds,
+            treated as equal. Default value is 1 microsecond
 
     Returns:
-        bool: True if the source file is more recent than the destination file, False otherwise.
+        bool: True if the source file differs from the destination file, False otherwise.
+    """
+    if src_stat is None:
+        src_stat = os.stat(src_file)
+    dest_stat = os.stat(dest_file)
+    # Files of different sizes differ, there is no need to hash them
+    if src_stat.st_size != dest_stat.st_size:
+        return True
+    if paranoid:
+        # Source files are live and may be truncated while hashed, only our copies are mapped
+        if cache is None:
+            return get_checksum(src_file, algorithm) != get_checksum(dest_file, algorithm, mapped=True)
+        return (cache.get_checksum(src_file, src_stat)
+                != cache.get_checksum(dest_file, dest_stat, mapped=True))
+    # Older sources count too, restoring a backup must reach the destination
+    return abs(src_stat.st_mtime_ns - dest_stat.st_mtime_ns) > modify_window_ns
+
+
+def watch_tree(inotify: 'INotify', directory: str) -> None:
     """
-    return get_checksum(src_file) != get_checksum(dest_file)
+    Watch a directory and all of its subdirectories for changes.
+    Directories that are already watched keep their existing watch. Directories that cannot
+    be watched are reported as a single error.
+
+    Args:
+        inotify (INotify): The inotify instance to add the watches to.
+        directory (str): The path to the directory to watch.
+
+    Returns:
+        Nothing
+    """
+    watch_flags = (inotify_flags.CREATE | inotify_flags.MODIFY | inotify_flags.ATTRIB
+                   | inotify_flags.DELETE | inotify_flags.MOVED_TO | inotify_flags.MOVED_FROM)
+    subdirs = [entry.path for entry, _ in _walk(directory) if entry.is_dir()]
+    failures = []
+    for subdir in [directory] + subdirs:
+        try:
+            inotify.add_watch(subdir, watch_flags)
+        except (FileNotFoundError, NotADirectoryError):
+            # Directories may disappear between listing and watching
+            pass
+        except OSError as error:
+            failures.append(error)
+    # Typically ENOSPC once fs.inotify.max_user_watches is exhausted, reported once per call
+    if failures:
+        view_message('Error: %d directories are not watched, their changes wait for the next full sweep '
+                     '(%s - %s)', len(failures), failures[0].filename, failures[0].strerror,
+                     log_level='error')
+
+
+def wait_for_changes(inotify: 'INotify', timeout: int) -> bool:
+    """
+    Block until a watched directory changes or the timeout expires.
+    After the first change, further changes are waited out for at most another timeout,
+    so files written continuously do not hold the sync back.
+
+    Args:
+        inotify (INotify): The inotify instance to read events from.
+        timeout (int): The longest time to wait, in seconds.
+
+    Returns:
+        bool: True if changes were detected, False if the timeout expired.
+    """
+    if not inotify.read(timeout=timeout * 1000):
+        return False
+    # Let a burst of changes settle so it is synced in one pass
+    deadline = monotonic() + timeout
+    while monotonic() < deadline and inotify.read(timeout=WATCH_DEBOUNCE_MS):
+        pass
+    return True
 
 
 if __name__ == '__main__':
@@ -178,30 +597,80 @@ if __name__ == '__main__':
                         help=f'The synchronization interval in seconds. Default value is {DEFAULT_INTERVAL}')
     parser.add_argument('-l', '--log_path', metavar='<log-path>', type=str, default=DEFAULT_LOG_PATH,
                         help=f'The log path for log. Default value is {DEFAULT_LOG_PATH}')
+    parser.add_argument('-p', '--paranoid', action='store_true',
+                        help='Compare files by checksum instead of size and modification time')
+    parser.add_argument('-a', '--algorithm', choices=sorted(HASH_ALGORITHMS), default=DEFAULT_ALGORITHM,
+                        help=f'The hash algorithm used in paranoid mode. blake3 and xxh3_128 require '
+                             f'the blake3 and xxhash packages. Default value is {DEFAULT_ALGORITHM}')
+    parser.add_argument('-c', '--cache_path', metavar='<cache-path>', type=str, default=DEFAULT_CACHE_PATH,
+                        help=f'The checksum cache path used in paranoid mode. Default value is {DEFAULT_CACHE_PATH}')
+    parser.add_argument('-j', '--parallelism', metavar='<parallelism>', type=int, default=DEFAULT_PARALLELISM,
+                        help=f'The most files synchronized at once. Default value is {DEFAULT_PARALLELISM}')
+    parser.add_argument('-m', '--modify_window', metavar='<seconds>', type=float,
+                        default=DEFAULT_MODIFY_WINDOW_NS / 1e9,
+                        help='The largest difference in modification times treated as equal, in seconds. '
+                             'Use 2 for FAT destinations. Default value is 1 microsecond')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='Sync as soon as the source changes instead of rescanning it every interval. '
+                             'Requires Linux and the inotify_simple package')
     # Parse command-line arguments
     args = parser.parse_args()
-
-    # Logging setup with customized format, date and file
-    logging.basicConfig(format='%(levelname)s,%(asctime)s,%(message)s',
-                        datefmt='%d.%m.%Y-%H:%M:%S',
-                        filename=args.log_path,
-                        level=logging.DEBUG)
-
-    view_message(f'Syncing between {args.src_dir} and {args.dst_dir}')
-    view_message(f'Interval set to {args.interval} seconds')
-    view_message(f'Logs being saved to {args.log_path}')
+    if args.parallelism < 1:
+        parser.error('--parallelism must be at least 1')
+    if args.modify_window < 0:
+        parser.error('--modify_window must not be negative')
+    if args.watch and INotify is None:
+        parser.error('--watch requires the inotify_simple package')
+
+    # Logging setup with customized format, date and file. Records are buffered in memory
+    # and written out together, at the end of every pass or as soon as an error is logged
+    log_file_handler = logging.FileHandler(args.log_path)
+    log_file_handler.setFormatter(logging.Formatter('%(levelname)s,%(asctime)s,%(message)s',
+                                                    datefmt='%d.%m.%Y-%H:%M:%S'))
+    log_handler = MemoryHandler(LOG_BUFFER_CAPACITY, flushLevel=logging.ERROR,
+                                target=log_file_handler)
+    logging.basicConfig(handlers=[log_handler], level=logging.DEBUG)
+
+    view_message('Syncing between %s and %s', args.src_dir, args.dst_dir)
+    view_message('Interval set to %d seconds', args.interval)
+    view_message('Logs being saved to %s', args.log_path)
+
+    checksum_cache = None
+    if args.paranoid:
+        checksum_cache = ChecksumCache(os.path.expanduser(args.cache_path), args.algorithm)
+        view_message('Checksums cached in %s', args.cache_path)
+        if args.algorithm == 'sha256' and not OPENSSL_SHA256:
+            view_message('SHA-256 is not provided by OpenSSL, hashing will not use CPU SHA extensions',
+                         log_level='warning')
+
+    source_inotify = None
+    if args.watch:
+        source_inotify = INotify()
+        watch_tree(source_inotify, args.src_dir)
+        view_message('Watching %s for changes', args.src_dir)
 
     while True:
         view_message('Syncing...')
-        synced_dirs = sync(args.src_dir, args.dst_dir)
+        synced_dirs = sync(args.src_dir, args.dst_dir, args.paranoid, checksum_cache,
+                           args.algorithm, args.parallelism, round(args.modify_window * 1e9))
         if len(synced_dirs) > 0:
             destination_map = read_dir(args.dst_dir)
+            synced_files = set(synced_dirs)
             files_to_remove = [
-                f for f in destination_map if f not in synced_dirs]
+                f for f in destination_map if f not in synced_files]
             remove_files(files_to_remove)
             remove_empty_folders(args.dst_dir)
         else:
             view_message('No changes detected')
         view_message('Syncing completed')
-
-        sleep(args.interval)
+        log_handler.flush()
+
+        if source_inotify is None:
+            sleep(args.interval)
+            continue
+        # Sleep until the source changes, with a full sweep every few intervals as a safety net
+        for _ in range(FULL_SWEEP_INTERVALS):
+            if wait_for_changes(source_inotify, args.interval):
+                # Watch directories created since the last pass
+                watch_tree(source_inotify, args.src_dir)
+                break
@@ -1,14 +1,35 @@
+import errno
+import hashlib
 import os
 import shutil
 import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 import logging
 from io import StringIO
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
-from sync import sync, read_dir, remove_files, remove_empty_folders
+from sync import view_message, sync, read_dir, remove_files, remove_empty_folders, is_updated, \
+    get_checksum, ChecksumCache, copy_file, HASH_ALGORITHMS, INotify, watch_tree, \
+    wait_for_changes
+
+
+class TestViewMessage(unittest.TestCase):
+    def test_view_message_formats_lazily(self):
+        with patch('logging.debug') as mock_debug, patch('sys.stdout', new_callable=StringIO) as stdout:
+            view_message('%s created', 'file.txt')
+        # Arguments are handed to the logger unformatted
+        mock_debug.assert_called_once_with('%s created', 'file.txt')
+        self.assertEqual(stdout.getvalue(), 'file.txt created\n')
+
+    def test_view_message_warning(self):
+        with patch('logging.warning') as mock_warning, patch('sys.stdout', new_callable=StringIO):
+            view_message('%s is slow', 'SHA-256', log_level='warning')
+        mock_warning.assert_called_once_with('%s is slow', 'SHA-256')
 
 
 class TestSync(unittest.TestCase):
@@ -80,6 +101,73 @@ class TestSync(unittest.TestCase):
             self.assertTrue(os.path.exists(dest_file))
             self.assertTrue(dest_file in synced_files)
 
+    def test_sync_paranoid_caches_copied_files(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache = ChecksumCache(os.path.join(cache_dir, 'cache.db'), 'sha256')
+        self.addCleanup(cache.close)
+        sync(self.temp_dir, self.dest_dir, paranoid=True, cache=cache)
+
+        # Neither the sources nor the copies written by the first pass are read again
+        with patch('sync.get_checksum') as mock_checksum:
+            sync(self.temp_dir, self.dest_dir, paranoid=True, cache=cache)
+        mock_checksum.assert_not_called()
+
+    def test_sync_paranoid_prunes_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache = ChecksumCache(os.path.join(cache_dir, 'cache.db'), 'sha256')
+        self.addCleanup(cache.close)
+        # Checksums of files outside the synchronized directories are left alone
+        other_file = os.path.join(cache_dir, 'other.txt')
+        with open(other_file, 'w') as f:
+            f.write('Test data')
+        cache.get_checksum(other_file)
+        sync(self.temp_dir, self.dest_dir, paranoid=True, cache=cache)
+
+        os.remove(self.files[0])
+        sync(self.temp_dir, self.dest_dir, paranoid=True, cache=cache)
+
+        cached_paths = {path for path, in cache.connection.execute(f'SELECT path FROM {cache.table}')}
+        dest_file1 = os.path.join(self.dest_dir, os.path.basename(self.files[0]))
+        self.assertNotIn(os.path.abspath(self.files[0]), cached_paths)
+        self.assertNotIn(os.path.abspath(dest_file1), cached_paths)
+        self.assertIn(os.path.abspath(self.files[1]), cached_paths)
+        self.assertIn(os.path.abspath(other_file), cached_paths)
+
+    def test_sync_paths_match_read_dir(self):
+        # Synced paths are compared against read_dir() to find files to remove
+        for dest_dir in (self.dest_dir, self.dest_dir + os.sep):
+            synced_files = sync(self.temp_dir, dest_dir)
+            self.assertEqual(sorted(synced_files), sorted(read_dir(dest_dir)))
+
+    def test_sync_does_not_compare_new_files(self):
+        # Freshly copied files are neither compared nor copied a second time
+        with patch('sync.is_updated') as mock_is_updated, \
+                patch('sync.copy_file', wraps=copy_file) as mock_copy_file:
+            sync(self.temp_dir, self.dest_dir, paranoid=True)
+        mock_is_updated.assert_not_called()
+        self.assertEqual(mock_copy_file.call_count, len(self.files))
+
+    def test_sync_hands_only_large_files_to_workers(self):
+        large_file = self.create_file('large.txt', 'x' * (64 << 10))
+        with patch.object(ThreadPoolExecutor, 'submit', autospec=True,
+                          side_effect=ThreadPoolExecutor.submit) as mock_submit:
+            synced_files = sync(self.temp_dir, self.dest_dir)
+        mock_submit.assert_called_once()
+        dest_large_file = os.path.join(self.dest_dir, 'large.txt')
+        self.assertIn(dest_large_file, synced_files)
+        self.assertEqual(get_checksum(dest_large_file), get_checksum(large_file))
+
+    def test_sync_serially(self):
+        self.create_file('large.txt', 'x' * (64 << 10))
+        # Every file, large ones included, is synced on the calling thread
+        with patch.object(ThreadPoolExecutor, 'submit') as mock_submit:
+            synced_files = sync(self.temp_dir, self.dest_dir, parallelism=1)
+        mock_submit.assert_not_called()
+        self.assertEqual(sorted(synced_files), sorted(read_dir(self.dest_dir)))
+        self.assertEqual(len(synced_files), len(self.files) + 1)
+
     def test_sync_updates_existing_files(self):
         # Create a file in the destination directory with the same name as file1
         dest_file1 = os.path.join(
@@ -98,6 +186,25 @@ class TestSync(unittest.TestCase):
         self.assertEqual(data, 'Test data')
         self.assertTrue(dest_file1 in synced_files)
 
+    def test_sync_paranoid_with_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache = ChecksumCache(os.path.join(cache_dir, 'cache.db'))
+        self.addCleanup(cache.close)
+        sync(self.temp_dir, self.dest_dir, paranoid=True, cache=cache)
+
+        # Same size and a newer destination, only the checksum tells the files apart
+        dest_file1 = os.path.join(self.dest_dir, os.path.basename(self.files[0]))
+        with open(dest_file1, 'w') as f:
+            f.write('Old  data')
+        mod_time = datetime.now() + timedelta(days=1)
+        os.utime(dest_file1, (mod_time.timestamp(), mod_time.timestamp()))
+
+        synced_files = sync(self.temp_dir, self.dest_dir, paranoid=True, cache=cache)
+        with open(dest_file1, 'r') as f:
+            self.assertEqual(f.read(), 'Test data')
+        self.assertEqual(len(synced_files), len(self.files))
+
 
 class TestReadDir(unittest.TestCase):
     def test_read_dir_returns_list_of_files(self):
@@ -119,6 +226,16 @@ class TestReadDir(unittest.TestCase):
             self.assertIn(file1, files)
             self.assertIn(file2, files)
 
+    def test_read_dir_returns_nested_files(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            os.makedirs(os.path.join(tempdir, 'subdir', 'empty'))
+            file1 = os.path.join(tempdir, 'subdir', 'file1.txt')
+            with open(file1, 'w') as f:
+                f.write('hello')
+
+            # Directories are not listed, only the files inside them
+            self.assertEqual(read_dir(tempdir), [file1])
+
     def test_read_dir_returns_empty_list_if_dir_does_not_exist(self):
         # Call the read_dir() function on a non-existent directory
         files = read_dir('nonexistent_dir')
@@ -235,6 +352,247 @@ class TestRemoveEmptyFolders(unittest.TestCase):
                 os.path.join(temp_dir, 'dir1', 'dir2', 'dir4')))
             self.assertFalse(os.path.exists(os.path.join(temp_dir, 'dir5')))
 
+    def test_remove_nested_empty_folders(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, 'dir1', 'dir2', 'dir3'))
+
+            remove_empty_folders(temp_dir)
+
+            # Parents left empty by removing their children are removed too, the root is kept
+            self.assertEqual(os.listdir(temp_dir), [])
+
+    def test_remove_nested_empty_folders_without_dir_fd(self):
+        # Platforms without dir_fd support fall back to removing directories by path
+        with patch('os.supports_dir_fd', set()):
+            self.test_remove_nested_empty_folders()
+            self.test_remove_empty_folders()
+
+
+class TestCopyFile(unittest.TestCase):
+    def test_copy_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            src_file = os.path.join(temp_dir, 'src.txt')
+            dest_file = os.path.join(temp_dir, 'dest.txt')
+            with open(src_file, 'w') as f:
+                f.write('Test data')
+            with open(dest_file, 'w') as f:
+                f.write('Old data')
+            os.chmod(src_file, 0o640)
+            mod_time = datetime.now() - timedelta(days=1)
+            os.utime(src_file, (mod_time.timestamp(), mod_time.timestamp()))
+
+            src_stat = os.stat(src_file)
+            copy_file(src_file, dest_file, src_stat)
+
+            dest_stat = os.stat(dest_file)
+            with open(dest_file, 'r') as f:
+                self.assertEqual(f.read(), 'Test data')
+            self.assertEqual(dest_stat.st_mtime_ns, src_stat.st_mtime_ns)
+            self.assertEqual(dest_stat.st_mode, src_stat.st_mode)
+            # No temporary files are left behind
+            self.assertEqual(sorted(os.listdir(temp_dir)), ['dest.txt', 'src.txt'])
+
+
+class TestGetChecksum(unittest.TestCase):
+    def test_get_checksum(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Empty, small, chunked and memory mapped files
+            for size in (0, 9, (256 << 10) + 1, (1 << 20) + 1):
+                data = os.urandom(size)
+                file_path = os.path.join(temp_dir, f'file{size}.bin')
+                with open(file_path, 'wb') as f:
+                    f.write(data)
+                for mapped in (False, True):
+                    self.assertEqual(get_checksum(file_path, 'sha256', mapped),
+                                     hashlib.sha256(data).digest())
+
+    def test_get_checksum_algorithms(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data = os.urandom((256 << 10) + 1)
+            file_path = os.path.join(temp_dir, 'file.bin')
+            with open(file_path, 'wb') as f:
+                f.write(data)
+            # Covers whichever optional algorithms are installed
+            for algorithm, hash_function in HASH_ALGORITHMS.items():
+                for mapped in (False, True):
+                    self.assertEqual(get_checksum(file_path, algorithm, mapped),
+                                     hash_function(data).digest())
+
+
+class TestChecksumCache(unittest.TestCase):
+    def setUp(self):
+        # Directory is removed after the caches opened by the tests are closed
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.cache_path = os.path.join(self.temp_dir, 'cache', 'cache.db')
+        self.file = os.path.join(self.temp_dir, 'file.txt')
+        with open(self.file, 'w') as f:
+            f.write('Test data')
+
+    def test_checksum_cache_reuses_digest(self):
+        cache = ChecksumCache(self.cache_path, 'sha256')
+        self.addCleanup(cache.close)
+        self.assertEqual(cache.get_checksum(self.file), get_checksum(self.file, 'sha256'))
+        # Unchanged file is not hashed again
+        with patch('sync.get_checksum') as mock_checksum:
+            self.assertEqual(cache.get_checksum(self.file),
+                             hashlib.sha256(b'Test data').digest())
+            mock_checksum.assert_not_called()
+
+    def test_checksum_cache_rehashes_changed_file(self):
+        cache = ChecksumCache(self.cache_path, 'sha256')
+        self.addCleanup(cache.close)
+        cache.get_checksum(self.file)
+        with open(self.file, 'w') as f:
+            f.write('Changed test data')
+        self.assertEqual(cache.get_checksum(self.file),
+                         hashlib.sha256(b'Changed test data').digest())
+
+    def test_checksum_cache_persists(self):
+        cache = ChecksumCache(self.cache_path, 'sha256')
+        cache.get_checksum(self.file)
+        cache.close()
+        cache = ChecksumCache(self.cache_path, 'sha256')
+        self.addCleanup(cache.close)
+        with patch('sync.get_checksum') as mock_checksum:
+            cache.get_checksum(self.file)
+            mock_checksum.assert_not_called()
+
+
+class TestIsUpdated(unittest.TestCase):
+    def setUp(self):
+        # Create a source and a destination file with identical metadata
+        self.temp_dir = tempfile.mkdtemp()
+        self.src_file = os.path.join(self.temp_dir, 'src.txt')
+        self.dest_file = os.path.join(self.temp_dir, 'dest.txt')
+        with open(self.src_file, 'w') as f:
+            f.write('Test data')
+        shutil.copy2(self.src_file, self.dest_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_is_updated_same_file(self):
+        self.assertFalse(is_updated(self.src_file, self.dest_file))
+        self.assertFalse(is_updated(self.src_file, self.dest_file, paranoid=True))
+
+    def test_is_updated_size_changed(self):
+        with open(self.src_file, 'w') as f:
+            f.write('Changed test data')
+        self.assertTrue(is_updated(self.src_file, self.dest_file))
+
+    def test_is_updated_paranoid_maps_only_destination(self):
+        # Mapping a source that is truncated while hashed would kill the process
+        with patch('sync.get_checksum', return_value=b'') as mock_checksum:
+            is_updated(self.src_file, self.dest_file, paranoid=True, algorithm='sha256')
+        mock_checksum.assert_any_call(self.src_file, 'sha256')
+        mock_checksum.assert_any_call(self.dest_file, 'sha256', mapped=True)
+
+    def test_is_updated_paranoid_size_changed(self):
+        with open(self.src_file, 'w') as f:
+            f.write('Changed test data')
+        # Different sizes are told apart without hashing
+        with patch('sync.get_checksum') as mock_checksum:
+            self.assertTrue(is_updated(self.src_file, self.dest_file, paranoid=True))
+        mock_checksum.assert_not_called()
+
+    def test_is_updated_newer_source(self):
+        mod_time = datetime.now() + timedelta(days=1)
+        os.utime(self.src_file, (mod_time.timestamp(), mod_time.timestamp()))
+        self.assertTrue(is_updated(self.src_file, self.dest_file))
+
+    def test_is_updated_truncated_dest_mtime(self):
+        # NTFS and SMB destinations truncate the modification time of the copy to 100 ns
+        src_mtime_ns = 1_700_000_000_987_654_321
+        os.utime(self.src_file, ns=(src_mtime_ns, src_mtime_ns))
+        dest_mtime_ns = src_mtime_ns // 100 * 100
+        os.utime(self.dest_file, ns=(dest_mtime_ns, dest_mtime_ns))
+        self.assertFalse(is_updated(self.src_file, self.dest_file))
+
+        # FAT keeps whole seconds only, which needs a wider window
+        dest_mtime_ns = src_mtime_ns // 10 ** 9 * 10 ** 9
+        os.utime(self.dest_file, ns=(dest_mtime_ns, dest_mtime_ns))
+        self.assertTrue(is_updated(self.src_file, self.dest_file))
+        self.assertFalse(is_updated(self.src_file, self.dest_file, modify_window_ns=2 * 10 ** 9))
+
+    def test_is_updated_same_size_edit(self):
+        # An edit of the same size a second later is a change
+        stat = os.stat(self.src_file)
+        with open(self.src_file, 'w') as f:
+            f.write('Best data')
+        os.utime(self.src_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertTrue(is_updated(self.src_file, self.dest_file))
+
+    def test_is_updated_older_source(self):
+        # Restoring an older version of the same size is a change too
+        mod_time = datetime.now() - timedelta(days=1)
+        os.utime(self.src_file, (mod_time.timestamp(), mod_time.timestamp()))
+        self.assertTrue(is_updated(self.src_file, self.dest_file))
+
+    def test_is_updated_paranoid_detects_content_change(self):
+        # Same size and modification time, different contents
+        stat = os.stat(self.dest_file)
+        with open(self.dest_file, 'w') as f:
+            f.write('Old  data')
+        os.utime(self.dest_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertFalse(is_updated(self.src_file, self.dest_file))
+        self.assertTrue(is_updated(self.src_file, self.dest_file, paranoid=True))
+
+
+@unittest.skipIf(INotify is None, 'inotify_simple is not installed')
+class TestWatch(unittest.TestCase):
+    def test_wait_for_changes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, 'subdir'))
+            with INotify() as inotify:
+                watch_tree(inotify, temp_dir)
+                self.assertFalse(wait_for_changes(inotify, 0))
+
+                # Changes in subdirectories are reported too
+                with open(os.path.join(temp_dir, 'subdir', 'file.txt'), 'w') as f:
+                    f.write('Test data')
+                self.assertTrue(wait_for_changes(inotify, 1))
+                self.assertFalse(wait_for_changes(inotify, 0))
+
+    def test_watch_tree_reports_unwatched_directories(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, 'subdir1'))
+            os.makedirs(os.path.join(temp_dir, 'subdir2'))
+            inotify = MagicMock()
+            inotify.add_watch.side_effect = OSError(errno.ENOSPC, 'No space left on device', temp_dir)
+            with patch('logging.error') as mock_error, patch('sys.stdout', new_callable=StringIO):
+                watch_tree(inotify, temp_dir)
+            mock_error.assert_called_once()
+            self.assertEqual(mock_error.call_args[0][1], 3)
+
+            # Directories removed before they are watched are not an error
+            inotify.add_watch.side_effect = FileNotFoundError
+            with patch('logging.error') as mock_error, patch('sys.stdout', new_callable=StringIO):
+                watch_tree(inotify, temp_dir)
+            mock_error.assert_not_called()
+
+    def test_wait_for_changes_returns_while_file_is_written(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            stop = threading.Event()
+
+            def append_continuously():
+                with open(os.path.join(temp_dir, 'growing.log'), 'w') as f:
+                    while not stop.wait(0.05):
+                        f.write('Test data')
+                        f.flush()
+
+            with INotify() as inotify:
+                watch_tree(inotify, temp_dir)
+                writer = threading.Thread(target=append_continuously)
+                writer.start()
+                self.addCleanup(writer.join)
+                self.addCleanup(stop.set)
+
+                # The debounce gives up after one more interval instead of waiting for quiet
+                started = time.monotonic()
+                self.assertTrue(wait_for_changes(inotify, 1))
+                self.assertLess(time.monotonic() - started, 3)
+
 
 if __name__ == '__main__':
     unittest.main()